@@ -12,6 +12,18 @@ class RAGConfig:
     OLLAMA_MODEL = "llama3.2:3b"
     PERSIST_DIRECTORY = "./chroma_db"
 
+    # Sharding do índice vetorial (1 = coleção única, sem sharding)
+    NUM_SHARDS = 1
+    SHARD_STRATEGY = "size"  # "size" (equilibra nº de chunks) ou "hash" (fonte inteira num shard)
+    SHARD_MAX_WORKERS = 4  # Threads para busca e indexação em paralelo
+
+    # Chunks enviados ao vector store por chamada durante a indexação
+    INDEX_BATCH_SIZE = 1000
+
+    # Similaridade de cosseno mínima entre a pergunta e o histórico recente;
+    # abaixo disso é considerada mudança de assunto
+    TOPIC_SHIFT_THRESHOLD = 0.35
+
     # Prompt "Analista Sênior"
     SYSTEM_PROMPT = """Você é um Analista de Dados Sênior e Assistente Inteligente. Sua missão é ler os documentos fornecidos e responder às perguntas do usuário de forma didática, organizada e completa.
 
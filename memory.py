@@ -1,3 +1,5 @@
+from typing import List, Optional
+
 class ConversationMemory:
     """Gerencia o histórico de conversas com buffer limitado"""
 
@@ -9,19 +11,22 @@ class ConversationMemory:
             max_turns: Número máximo de turnos (pares pergunta-resposta) a manter
         """
         self.max_turns = max_turns
-        self.history = []  # Lista de dicionários com 'role' e 'content'
+        self.history = []  # Lista de dicionários com 'role', 'content' (e 'embedding' do usuário)
 
-    def add_interaction(self, user_message: str, assistant_message: str):
+    def add_interaction(self, user_message: str, assistant_message: str,
+                        user_embedding: Optional[List[float]] = None):
         """
         Adiciona uma interação completa ao histórico
 
         Args:
             user_message: Mensagem do usuário
             assistant_message: Resposta do assistente
+            user_embedding: Embedding já calculado da mensagem do usuário
         """
         self.history.append({
             'role': 'user',
-            'content': user_message
+            'content': user_message,
+            'embedding': user_embedding
         })
         self.history.append({
             'role': 'assistant',
@@ -50,6 +55,19 @@ class ConversationMemory:
 
         return "\n\n".join(formatted)
 
+    def get_user_embeddings(self) -> List[List[float]]:
+        """Retorna os embeddings em cache das perguntas recentes do usuário"""
+        return [
+            msg['embedding'] for msg in self.history
+            if msg['role'] == 'user' and msg.get('embedding') is not None
+        ]
+
+    def estimate_tokens(self) -> int:
+        """Estima quantos tokens o histórico ocupa no prompt (~4 caracteres por token)"""
+        if not self.history:
+            return 0
+        return len(self.get_formatted_history()) // 4
+
     def clear(self):
         """Limpa todo o histórico de conversas"""
         self.history = []
@@ -1,5 +1,9 @@
+import sys
+from array import array
+from typing import Dict, Iterator, List, Optional, Tuple
 from langchain_text_splitters import RecursiveCharacterTextSplitter
 from langchain_core.documents import Document
+from src.config import RAGConfig
 
 class TextChunker:
     """Divide texto em chunks menores mantendo contexto"""
@@ -20,6 +24,21 @@ class TextChunker:
             separators=["\n\n", "\n", ". ", " ", ""]  # Ordem de preferência para quebras
         )
 
+    def split_text(self, text: str) -> List[str]:
+        """
+        Divide texto em chunks sem criar Documents
+
+        Args:
+            text: Texto a ser dividido
+
+        Returns:
+            Lista com o texto de cada chunk
+        """
+        if not text or len(text.strip()) == 0:
+            raise ValueError("Texto vazio fornecido para chunking")
+
+        return self.text_splitter.split_text(text)
+
     def chunk_text(self, text: str, metadata: Optional[Dict] = None) -> List[Document]:
         """
         Divide texto em chunks
@@ -32,11 +51,8 @@ class TextChunker:
             Lista de Documents do LangChain
         """
         try:
-            if not text or len(text.strip()) == 0:
-                raise ValueError("Texto vazio fornecido para chunking")
-
             # Cria chunks
-            chunks = self.text_splitter.split_text(text)
+            chunks = self.split_text(text)
 
             # Converte para Documents com metadata
             documents = []
@@ -53,4 +69,130 @@ class TextChunker:
             return documents
 
         except Exception as e:
-            raise Exception(f"Erro ao fazer chunking do texto: {str(e)}")
\ No newline at end of file
+            raise Exception(f"Erro ao fazer chunking do texto: {str(e)}")
+
+
+class ChunkStore:
+    """
+    Armazena chunks de forma compacta até a indexação
+
+    Os metadados comuns a todos os chunks de uma fonte (source, filename...)
+    são guardados uma única vez; por chunk ficam apenas o texto e dois inteiros
+    em arrays (índice dos metadados e chunk_id).
+    """
+
+    __slots__ = ('_texts', '_meta_index', '_chunk_ids', '_metadatas', 'indexed')
+
+    def __init__(self):
+        self._texts: List[str] = []
+        self._meta_index = array('I')  # Índice em self._metadatas por chunk
+        self._chunk_ids = array('I')   # Posição do chunk dentro da fonte
+        self._metadatas: List[Dict] = []
+        self.indexed = 0  # Chunks iniciais já gravados no vector store
+
+    def __len__(self) -> int:
+        return len(self._texts)
+
+    def __bool__(self) -> bool:
+        return bool(self._texts)
+
+    def add_texts(self, texts: List[str], metadata: Optional[Dict] = None) -> None:
+        """
+        Adiciona os chunks de uma fonte
+
+        Args:
+            texts: Texto de cada chunk
+            metadata: Metadados compartilhados por todos os chunks da fonte
+        """
+        shared = {
+            key: sys.intern(value) if isinstance(value, str) else value
+            for key, value in (metadata or {}).items()
+        }
+        shared['chunk_total'] = len(texts)
+
+        meta_idx = len(self._metadatas)
+        self._metadatas.append(shared)
+
+        for i, text in enumerate(texts):
+            self._texts.append(text)
+            self._meta_index.append(meta_idx)
+            self._chunk_ids.append(i)
+
+    def sources(self) -> List[str]:
+        """Retorna as fontes distintas com chunks em staging"""
+        return list(dict.fromkeys(
+            str(shared['source']) for shared in self._metadatas if 'source' in shared
+        ))
+
+    def get_metadata(self, index: int) -> Dict:
+        """Reconstrói os metadados completos de um chunk"""
+        metadata = dict(self._metadatas[self._meta_index[index]])
+        metadata['chunk_id'] = self._chunk_ids[index]
+        return metadata
+
+    def texts(self) -> Tuple[str, ...]:
+        """Retorna os textos dos chunks (cópia imutável)"""
+        return tuple(self._texts)
+
+    def metadatas(self) -> Iterator[Dict]:
+        """Gera os metadados de cada chunk sob demanda"""
+        for i in range(len(self._texts)):
+            yield self.get_metadata(i)
+
+    def iter_batches(self, batch_size: int, start: int = 0) -> Iterator[Tuple[List[str], List[Dict]]]:
+        """
+        Gera lotes de (textos, metadados) para indexação
+
+        Só os metadados do lote atual são materializados, mantendo o pico de
+        memória limitado a batch_size dicionários.
+
+        Args:
+            batch_size: Número de chunks por lote
+            start: Primeiro chunk (ex: self.indexed, para retomar uma indexação)
+        """
+        for start in range(start, len(self._texts), batch_size):
+            end = min(start + batch_size, len(self._texts))
+            yield self._texts[start:end], [self.get_metadata(i) for i in range(start, end)]
+
+    def release(self) -> None:
+        """Libera os chunks após a indexação"""
+        self._texts = []
+        self._meta_index = array('I')
+        self._chunk_ids = array('I')
+        self._metadatas = []
+        self.indexed = 0
+
+    def memory_usage(self) -> Dict[str, int]:
+        """
+        Estima o uso de memória do armazenamento
+
+        Returns:
+            Dicionário com número de chunks/fontes, bytes usados pela forma
+            compacta e estimativa equivalente com um Document por chunk
+        """
+        text_bytes = sys.getsizeof(self._texts) + sum(sys.getsizeof(t) for t in self._texts)
+        record_bytes = (sys.getsizeof(self._meta_index) + sys.getsizeof(self._chunk_ids)
+                        + sys.getsizeof(self._metadatas)
+                        + sum(sys.getsizeof(m) for m in self._metadatas))
+
+        # Cada Document teria seu próprio dict de metadados (com o int de chunk_id);
+        # o tamanho é o mesmo para todos os chunks de uma fonte
+        per_chunk_meta = sum(
+            (sys.getsizeof(dict(shared, chunk_id=0)) + sys.getsizeof(shared['chunk_total']))
+            * shared['chunk_total']
+            for shared in self._metadatas
+        )
+
+        # Mais o próprio objeto Document (instância pydantic e seus dicts internos)
+        sample = Document(page_content="", metadata={})
+        document_overhead = (sys.getsizeof(sample) + sys.getsizeof(sample.__dict__)
+                             + sys.getsizeof(getattr(sample, '__pydantic_fields_set__', set())))
+
+        document_bytes = text_bytes + per_chunk_meta + document_overhead * len(self._texts)
+
+        return {
+            'chunks': len(self._texts),
+            'sources': len(self._metadatas),
+            'compact_bytes': text_bytes + record_bytes,
+            'documents_bytes': document_bytes,
+        }
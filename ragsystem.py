@@ -1,22 +1,28 @@
 import os
+import re
+from typing import Dict, List, Optional
+from langchain_core.documents import Document
 from langchain_community.embeddings import HuggingFaceEmbeddings
 from langchain_community.vectorstores import Chroma
 from src.config import RAGConfig
 from src.memory import ConversationMemory
 from src.loaders import DocumentLoader, WebScraper
-from src.processing import TextChunker
+from src.processing import TextChunker, ChunkStore
 from src.llm import OllamaManager
+from src.vectorstore import ShardedVectorStore, benchmark_shards, check_shard_layout
 
 class RAGSystem:
     """Sistema RAG completo com busca vetorial e geração de respostas usando Ollama"""
 
-    def __init__(self, model_name: str = RAGConfig.OLLAMA_MODEL, memory_turns: int = 3):
+    def __init__(self, model_name: str = RAGConfig.OLLAMA_MODEL, memory_turns: int = 3,
+                 topic_shift_threshold: float = RAGConfig.TOPIC_SHIFT_THRESHOLD):
         """
         Inicializa o sistema RAG com memória conversacional
 
         Args:
             model_name: Nome do modelo Ollama a usar
             memory_turns: Número de turnos de conversa a manter na memória
+            topic_shift_threshold: Similaridade mínima com o histórico para mantê-lo
         """
         print("🔧 Inicializando Sistema RAG (100% Open Source)...")
 
@@ -45,6 +51,10 @@ class RAGSystem:
         self.memory = ConversationMemory(max_turns=memory_turns)
         print(f"🧠 Memória conversacional ativada ({memory_turns} turnos)")
 
+        # Detecção de mudança de assunto e métrica de tokens de histórico economizados
+        self.topic_shift_threshold = topic_shift_threshold
+        self.history_stats = {'queries': 0, 'shifts': 0, 'tokens_saved': 0}
+
         # Inicializa modelo de embeddings (roda localmente, sem custo)
         print("📥 Carregando modelo de embeddings...")
         self.embeddings = HuggingFaceEmbeddings(
@@ -56,7 +66,7 @@ class RAGSystem:
         # Inicializa componentes
         self.chunker = TextChunker()
         self.vectorstore = None
-        self.documents = []
+        self.documents = ChunkStore()  # Área de staging, liberada após a indexação
 
         print("✅ Sistema RAG inicializado com sucesso!\n")
 
@@ -74,9 +84,9 @@ class RAGSystem:
                 'source_type': 'file',
                 'filename': os.path.basename(file_path)
             }
-            chunks = self.chunker.chunk_text(text, metadata)
+            chunks = self.chunker.split_text(text)
 
-            self.documents.extend(chunks)
+            self.documents.add_texts(chunks, metadata)
             print(f"✅ Arquivo processado: {len(chunks)} chunks criados\n")
 
         except Exception as e:
@@ -96,9 +106,9 @@ class RAGSystem:
                 'source': url,
                 'source_type': 'url'
             }
-            chunks = self.chunker.chunk_text(text, metadata)
+            chunks = self.chunker.split_text(text)
 
-            self.documents.extend(chunks)
+            self.documents.add_texts(chunks, metadata)
             print(f"✅ URL processada: {len(chunks)} chunks criados\n")
 
         except Exception as e:
@@ -109,16 +119,56 @@ class RAGSystem:
         """Constrói o vector store a partir dos documentos adicionados"""
         try:
             if not self.documents:
+                if self.vectorstore is not None:
+                    print("ℹ️  Nenhum chunk novo para indexar; o vector store já está atualizado.\n")
+                    return
                 raise ValueError("Nenhum documento foi adicionado ao sistema")
 
-            print(f"🔨 Construindo vector store com {len(self.documents)} chunks...")
-
-            # Cria vector store
-            self.vectorstore = Chroma.from_documents(
-                documents=self.documents,
-                embedding=self.embeddings,
-                persist_directory=RAGConfig.PERSIST_DIRECTORY
-            )
+            pending = len(self.documents) - self.documents.indexed
+            print(f"🔨 Construindo vector store com {pending} chunks...")
+            self.show_memory_usage()
+
+            if self.vectorstore is None and RAGConfig.NUM_SHARDS > 1:
+                # Abre os shards já persistidos (ou cria novos) e indexa em paralelo
+                self.vectorstore = ShardedVectorStore.load(self.embeddings)
+            elif self.vectorstore is None:
+                # Cria vector store
+                check_shard_layout(RAGConfig.PERSIST_DIRECTORY, None)
+                self.vectorstore = Chroma(
+                    embedding_function=self.embeddings,
+                    persist_directory=RAGConfig.PERSIST_DIRECTORY
+                )
+
+            if self.documents.indexed == 0:
+                # Fontes reindexadas substituem os chunks antigos
+                sources = self.documents.sources()
+                if isinstance(self.vectorstore, ShardedVectorStore):
+                    self.vectorstore.delete_sources(sources)
+                elif sources:
+                    self.vectorstore._collection.delete(where={'source': {'$in': sources}})
+
+            # Indexa em lotes para não materializar os metadados de todos os chunks de uma vez;
+            # se um lote falhar, a próxima chamada retoma a partir do último lote gravado
+            for texts, metadatas in self.documents.iter_batches(RAGConfig.INDEX_BATCH_SIZE,
+                                                                start=self.documents.indexed):
+                if isinstance(self.vectorstore, ShardedVectorStore):
+                    self.vectorstore.add_texts(texts=texts, metadatas=metadatas)
+                else:
+                    # Mesmos ids estáveis dos shards: reindexar não duplica chunks
+                    ids, keep = ShardedVectorStore.unique_chunks(texts, metadatas)
+                    self.vectorstore.add_texts(
+                        texts=[texts[i] for i in keep],
+                        metadatas=[metadatas[i] for i in keep],
+                        ids=ids
+                    )
+                self.documents.indexed += len(texts)
+
+            if isinstance(self.vectorstore, ShardedVectorStore):
+                sizes = ", ".join(str(size) for size in self.vectorstore.shard_sizes)
+                print(f"🧩 {self.vectorstore.num_shards} shards ({self.vectorstore.strategy}): [{sizes}] chunks")
+
+            # Os chunks já estão no Chroma, não precisam ficar em memória
+            self.documents.release()
 
             print("✅ Vector store construído com sucesso!\n")
 
@@ -126,14 +176,98 @@ class RAGSystem:
             print(f"❌ Erro ao construir vector store: {str(e)}\n")
             raise
 
-    def retrieve_context(self, query: str, top_k: int = RAGConfig.TOP_K_RESULTS) -> List[Document]:
-        """Recupera chunks mais relevantes para a query"""
+    def load_vectorstore(self) -> None:
+        """
+        Abre o vector store já persistido em RAGConfig.PERSIST_DIRECTORY
+
+        Permite fazer perguntas sem reindexar, inclusive sobre shards
+        construídos por outros processos de ingestão.
+        """
+        try:
+            self._close_vectorstore()
+
+            if RAGConfig.NUM_SHARDS > 1:
+                self.vectorstore = ShardedVectorStore.load(self.embeddings)
+                total = sum(self.vectorstore.shard_sizes)
+            else:
+                check_shard_layout(RAGConfig.PERSIST_DIRECTORY, None)
+                self.vectorstore = Chroma(
+                    embedding_function=self.embeddings,
+                    persist_directory=RAGConfig.PERSIST_DIRECTORY
+                )
+                total = self.vectorstore._collection.count()
+
+            if total == 0:
+                self._close_vectorstore()
+                raise ValueError(f"Nenhum chunk indexado encontrado em {RAGConfig.PERSIST_DIRECTORY}")
+
+            print(f"✅ Vector store carregado: {total} chunks\n")
+
+        except Exception as e:
+            print(f"❌ Erro ao carregar vector store: {str(e)}\n")
+            raise
+
+    def _close_vectorstore(self) -> None:
+        """Descarta o vector store atual, liberando as threads dos shards"""
+        if isinstance(self.vectorstore, ShardedVectorStore):
+            self.vectorstore.close()
+        self.vectorstore = None
+
+    def show_memory_usage(self) -> None:
+        """Exibe o uso de memória dos chunks ainda não indexados"""
+        usage = self.documents.memory_usage()
+        chunks = max(usage['chunks'], 1)
+        print(f"📊 Memória dos chunks: {usage['chunks']} chunks de {usage['sources']} fontes | "
+              f"compacto: {usage['compact_bytes'] / 1024:.1f} KB "
+              f"({usage['compact_bytes'] / chunks:.0f} B/chunk) | "
+              f"com Documents: {usage['documents_bytes'] / 1024:.1f} KB "
+              f"({usage['documents_bytes'] / chunks:.0f} B/chunk)")
+
+    def benchmark_shards(self, queries: List[str], shard_counts: tuple = (1, 2, 4, 8)) -> Dict:
+        """
+        Mede a latência de busca com diferentes números de shards
+
+        Deve ser chamado antes de build_vectorstore(), enquanto os chunks
+        ainda estão em memória.
+
+        Args:
+            queries: Perguntas usadas na medição
+            shard_counts: Números de shards a comparar
+
+        Returns:
+            Dicionário {num_shards: {'build_s', 'mean_ms', 'p95_ms'}}
+        """
+        if not self.documents:
+            raise ValueError("Nenhum chunk em memória. Adicione documentos antes de build_vectorstore().")
+
+        print(f"⏱️  Benchmark de sharding com {len(self.documents)} chunks e {len(queries)} perguntas...")
+        return benchmark_shards(
+            self.embeddings,
+            self.documents.texts(),
+            list(self.documents.metadatas()),
+            queries,
+            shard_counts=shard_counts
+        )
+
+    def retrieve_context(self, query: str, top_k: int = RAGConfig.TOP_K_RESULTS,
+                         query_embedding: Optional[List[float]] = None) -> List[Document]:
+        """
+        Recupera chunks mais relevantes para a query
+
+        Args:
+            query: Pergunta do usuário
+            top_k: Número de chunks a retornar
+            query_embedding: Embedding já calculado da query (evita recalcular)
+        """
         try:
             if self.vectorstore is None:
                 raise ValueError("Vector store não foi construído. Execute build_vectorstore() primeiro.")
 
+            if query_embedding is None:
+                query_embedding = self.embeddings.embed_query(query)
+
             # Busca por similaridade
-            results = self.vectorstore.similarity_search(query, k=top_k)
+            results = self.vectorstore.similarity_search_by_vector(query_embedding, k=top_k)
 
             return results
 
@@ -141,7 +275,8 @@ class RAGSystem:
             print(f"❌ Erro na busca: {str(e)}")
             raise
 
-    def generate_answer(self, query: str, context_docs: List[Document]) -> str:
+    def generate_answer(self, query: str, context_docs: List[Document],
+                        query_embedding: Optional[List[float]] = None) -> str:
         """Gera resposta usando Ollama baseado no contexto recuperado E histórico de conversa"""
         try:
             # Formata contexto dos documentos
@@ -192,7 +327,7 @@ Responda de forma objetiva baseando-se APENAS nas informações dos documentos."
             )
 
             # 🆕 Adiciona interação à memória
-            self.memory.add_interaction(query, answer)
+            self.memory.add_interaction(query, answer, user_embedding=query_embedding)
 
             return answer
 
@@ -209,15 +344,24 @@ Responda de forma objetiva baseando-se APENAS nas informações dos documentos."
         print("🧠 MEMÓRIA CONVERSACIONAL")
         print("="*70)
         print(f"Turnos armazenados: {self.memory.get_turn_count()}/{self.memory.max_turns}")
+        queries = max(self.history_stats['queries'], 1)
+        print(f"Mudanças de assunto: {self.history_stats['shifts']} | "
+              f"tokens de histórico economizados: {self.history_stats['tokens_saved']} "
+              f"(~{self.history_stats['tokens_saved'] / queries:.0f} por pergunta)")
         print("\n" + self.memory.get_formatted_history())
         print("="*70 + "\n")
 
-    def is_query_related_to_history(self, query: str) -> bool:
+    def is_query_related_to_history(self, query: str,
+                                    query_embedding: Optional[List[float]] = None) -> bool:
         """
         Verifica se a pergunta se relaciona com o histórico recente
 
+        Compara o embedding da pergunta com os embeddings em cache das
+        perguntas anteriores, sem chamadas extras ao modelo.
+
         Args:
             query: Pergunta atual
+            query_embedding: Embedding já calculado da pergunta
 
         Returns:
             True se relacionada, False caso contrário
@@ -233,16 +377,27 @@ Responda de forma objetiva baseando-se APENAS nas informações dos documentos."
 
         query_lower = query.lower()
 
-        # Se a pergunta contém palavras de referência, é relacionada
-        if any(word in query_lower for word in reference_words):
+        # Se a pergunta contém palavras de referência (palavras inteiras), é relacionada;
+        # evita falsos positivos como "antes" em "restaurantes" ou "isso" em "compromisso"
+        pattern = r'\b(?:' + '|'.join(re.escape(word) for word in reference_words) + r')\b'
+        if re.search(pattern, query_lower):
             return True
 
-        # Se a pergunta tem mais de 10 palavras e não tem referências, provavelmente é nova
-        if len(query.split()) > 10:
-            return False
+        history_embeddings = self.memory.get_user_embeddings()
+        if not history_embeddings:
+            # Sem embeddings em cache não há como comparar; mantém o histórico
+            return True
 
-        # Para perguntas curtas, assume que pode ser relacionada
-        return True
+        if query_embedding is None:
+            query_embedding = self.embeddings.embed_query(query)
+
+        # Embeddings normalizados: produto escalar = similaridade de cosseno
+        similarity = max(
+            sum(a * b for a, b in zip(query_embedding, embedding))
+            for embedding in history_embeddings
+        )
+
+        return similarity >= self.topic_shift_threshold
 
     def query(self, question: str, show_context: bool = False, auto_clear_memory: bool = False) -> str:
         """
@@ -256,18 +411,29 @@ Responda de forma objetiva baseando-se APENAS nas informações dos documentos."
         try:
             print(f"\n❓ Pergunta: {question}\n")
 
+            # Embedding calculado uma vez: usado na busca e na detecção de mudança de assunto
+            query_embedding = self.embeddings.embed_query(question)
+            self.history_stats['queries'] += 1
+
             # 🆕 NOVO: Detecta se é uma mudança de assunto
-            if auto_clear_memory and not self.is_query_related_to_history(question):
+            if auto_clear_memory and not self.is_query_related_to_history(question, query_embedding):
                 if self.memory.get_turn_count() > 0:
-                    print("🔄 Mudança de assunto detectada. Limpando memória anterior...\n")
+                    tokens_saved = self.memory.estimate_tokens()
+                    self.history_stats['shifts'] += 1
+                    self.history_stats['tokens_saved'] += tokens_saved
+                    print(f"🔄 Mudança de assunto detectada. Limpando memória anterior "
+                          f"(~{tokens_saved} tokens economizados)...\n")
                     self.memory.clear()
 
             # Recupera contexto
             print("🔍 Buscando informações relevantes...")
-            context_docs = self.retrieve_context(question)
+            context_docs = self.retrieve_context(question, query_embedding=query_embedding)
 
             if show_context:
                 print("\n📚 Contexto recuperado:")
+                if isinstance(self.vectorstore, ShardedVectorStore):
+                    print(f"🧩 Busca em {self.vectorstore.num_shards} shards: "
+                          f"{self.vectorstore.last_search_ms:.1f} ms")
                 for i, doc in enumerate(context_docs, 1):
                     print(f"\n--- Chunk {i} ---")
                     print(f"Fonte: {doc.metadata.get('source', 'Desconhecida')}")
@@ -275,7 +441,7 @@ Responda de forma objetiva baseando-se APENAS nas informações dos documentos."
 
             # Gera resposta
             print(f"\n💭 Gerando resposta com {self.model_name}...")
-            answer = self.generate_answer(question, context_docs)
+            answer = self.generate_answer(question, context_docs, query_embedding)
 
             print("\n✅ Resposta gerada!\n")
             return answer
@@ -0,0 +1,406 @@
+import os
+import json
+import time
+import heapq
+import hashlib
+import zlib
+from concurrent.futures import ThreadPoolExecutor
+from typing import Dict, List, Optional, Tuple
+from langchain_core.documents import Document
+from langchain_community.vectorstores import Chroma
+from src.config import RAGConfig
+
+# Layout dos shards gravado em PERSIST_DIRECTORY na primeira escrita
+MANIFEST_FILE = "shards.json"
+
+
+def read_shard_manifest(persist_directory: Optional[str]) -> Optional[Dict]:
+    """Lê o manifesto de shards de um diretório, se existir"""
+    if persist_directory is None:
+        return None
+
+    path = os.path.join(persist_directory, MANIFEST_FILE)
+    if not os.path.exists(path):
+        return None
+
+    with open(path, 'r', encoding='utf-8') as f:
+        return json.load(f)
+
+
+def check_shard_layout(persist_directory: Optional[str], num_shards: Optional[int],
+                       strategy: str = RAGConfig.SHARD_STRATEGY,
+                       collection_name: str = "shard") -> None:
+    """
+    Verifica se a configuração corresponde ao índice já persistido
+
+    Abrir um índice com outro número de shards deixaria chunks fora da busca
+    e mandaria chunks reindexados para shards diferentes (duplicando-os).
+
+    Args:
+        persist_directory: Diretório do índice
+        num_shards: Número de shards configurado (None = coleção única, sem sharding)
+        strategy: Estratégia de sharding configurada
+        collection_name: Prefixo das coleções dos shards
+
+    Raises:
+        ValueError: Se o índice em disco tiver outro layout
+    """
+    if persist_directory is None:
+        return
+
+    manifest = read_shard_manifest(persist_directory)
+
+    if manifest is None:
+        if num_shards is not None and os.path.exists(os.path.join(persist_directory, "chroma.sqlite3")):
+            raise ValueError(
+                f"{persist_directory} contém um índice sem sharding; "
+                f"use RAGConfig.NUM_SHARDS = 1 ou outro PERSIST_DIRECTORY"
+            )
+        return
+
+    expected = {'num_shards': num_shards, 'strategy': strategy, 'collection_name': collection_name}
+    if num_shards is None or manifest != expected:
+        requested = "sem sharding" if num_shards is None else f"{num_shards} shard(s) (estratégia '{strategy}')"
+        raise ValueError(
+            f"{persist_directory} contém um índice com {manifest['num_shards']} shards "
+            f"(estratégia '{manifest['strategy']}'), mas a configuração pede {requested}; "
+            f"ajuste RAGConfig.NUM_SHARDS/SHARD_STRATEGY ou use outro PERSIST_DIRECTORY"
+        )
+
+
+class ShardedVectorStore:
+    """Índice vetorial dividido em N coleções Chroma com busca em paralelo"""
+
+    def __init__(self, embeddings, num_shards: int = RAGConfig.NUM_SHARDS,
+                 strategy: str = RAGConfig.SHARD_STRATEGY,
+                 persist_directory: Optional[str] = RAGConfig.PERSIST_DIRECTORY,
+                 max_workers: int = RAGConfig.SHARD_MAX_WORKERS,
+                 collection_name: str = "shard"):
+        """
+        Inicializa o índice particionado
+
+        Args:
+            embeddings: Modelo de embeddings compartilhado pelos shards
+            num_shards: Número de shards
+            strategy: "hash" (fonte inteira no shard do seu hash) ou "size"
+                (chunks de cada fonte distribuídos em rodízio entre os shards)
+            persist_directory: Diretório base; cada shard usa um subdiretório.
+                None mantém os shards apenas em memória
+            max_workers: Número de threads para busca e indexação
+            collection_name: Prefixo do nome das coleções de cada shard
+        """
+        if num_shards < 1:
+            raise ValueError("num_shards deve ser pelo menos 1")
+        if strategy not in ("hash", "size"):
+            raise ValueError(f"Estratégia de sharding desconhecida: {strategy}")
+        check_shard_layout(persist_directory, num_shards, strategy, collection_name)
+
+        self.embeddings = embeddings
+        self.num_shards = num_shards
+        self.strategy = strategy
+        self.persist_directory = persist_directory
+        self.max_workers = max(1, min(max_workers, num_shards))
+        self.collection_name = collection_name
+
+        self.shards: List[Optional[Chroma]] = [None] * num_shards
+        self.shard_sizes = [0] * num_shards
+        self.last_search_ms = 0.0
+        # Pool reutilizado entre buscas, para não pagar a criação de threads por query
+        self._executor = ThreadPoolExecutor(max_workers=self.max_workers)
+
+    def _shard_directory(self, shard_id: int) -> Optional[str]:
+        """Diretório de persistência de um shard"""
+        if self.persist_directory is None:
+            return None
+        return os.path.join(self.persist_directory, f"shard_{shard_id}")
+
+    def _write_manifest(self) -> None:
+        """Grava o layout dos shards no diretório base, se ainda não existir"""
+        if self.persist_directory is None or read_shard_manifest(self.persist_directory):
+            return
+
+        os.makedirs(self.persist_directory, exist_ok=True)
+        with open(os.path.join(self.persist_directory, MANIFEST_FILE), 'w', encoding='utf-8') as f:
+            json.dump({
+                'num_shards': self.num_shards,
+                'strategy': self.strategy,
+                'collection_name': self.collection_name,
+            }, f)
+
+    def _open_shard(self, shard_id: int) -> Chroma:
+        """Abre (ou cria) a coleção Chroma de um shard"""
+        self._write_manifest()
+        return Chroma(
+            collection_name=f"{self.collection_name}_{shard_id}",
+            embedding_function=self.embeddings,
+            persist_directory=self._shard_directory(shard_id)
+        )
+
+    @staticmethod
+    def chunk_id(text: str, metadata: Dict) -> str:
+        """
+        Gera um id estável para o chunk
+
+        Reindexar a mesma fonte sobrescreve os chunks em vez de duplicá-los.
+        """
+        if 'source' in metadata and 'chunk_id' in metadata:
+            return f"{metadata['source']}#{metadata['chunk_id']}"
+        return hashlib.md5(text.encode('utf-8')).hexdigest()
+
+    @classmethod
+    def unique_chunks(cls, texts: List[str], metadatas: List[Dict]) -> Tuple[List[str], List[int]]:
+        """
+        Calcula os ids dos chunks descartando ids repetidos
+
+        Uma fonte adicionada duas vezes antes da indexação gera ids repetidos,
+        que o Chroma rejeita numa mesma escrita; fica a última ocorrência.
+
+        Returns:
+            (ids únicos, índices dos chunks correspondentes)
+        """
+        last: Dict[str, int] = {}
+        for i, (text, metadata) in enumerate(zip(texts, metadatas)):
+            last[cls.chunk_id(text, metadata)] = i
+        return list(last.keys()), list(last.values())
+
+    def assign_shard(self, source: str, chunk_id: int = 0) -> int:
+        """
+        Escolhe o shard de um chunk
+
+        Com "hash" todos os chunks de uma fonte ficam no mesmo shard. Com
+        "size" os chunks de cada fonte são distribuídos em rodízio a partir do
+        shard da fonte, equilibrando o número de chunks por shard. Nos dois
+        casos a escolha é determinística, então reindexar um chunk sempre o
+        leva ao mesmo shard.
+        """
+        # crc32 é estável entre execuções (hash() do Python não é)
+        offset = zlib.crc32(source.encode('utf-8'))
+
+        if self.strategy == "hash":
+            return offset % self.num_shards
+
+        return (offset + chunk_id) % self.num_shards
+
+    def partition(self, texts: List[str], metadatas: List[Dict]) -> List[List[int]]:
+        """
+        Divide chunks entre os shards
+
+        Args:
+            texts: Texto de cada chunk
+            metadatas: Metadados de cada chunk (usa 'source' e 'chunk_id')
+
+        Returns:
+            Lista com os índices dos chunks de cada shard
+        """
+        parts: List[List[int]] = [[] for _ in range(self.num_shards)]
+        for i, metadata in enumerate(metadatas):
+            shard_id = self.assign_shard(str(metadata.get('source', '')),
+                                         int(metadata.get('chunk_id', i)))
+            parts[shard_id].append(i)
+
+        return parts
+
+    def build_shard(self, shard_id: int, texts: List[str], metadatas: List[Dict],
+                    embeddings: Optional[List[List[float]]] = None) -> None:
+        """
+        Indexa chunks em um único shard
+
+        Pode ser chamado de forma independente (ex: por processos de ingestão
+        separados, seguidos de load() no processo de busca), desde que cada
+        shard seja escrito por um só processo.
+
+        Args:
+            shard_id: Shard de destino
+            texts: Texto de cada chunk
+            metadatas: Metadados de cada chunk
+            embeddings: Embeddings já calculados; se None, são calculados aqui
+        """
+        if not texts:
+            return
+
+        if embeddings is None:
+            embeddings = self.embeddings.embed_documents(texts)
+
+        if self.shards[shard_id] is None:
+            self.shards[shard_id] = self._open_shard(shard_id)
+
+        ids, keep = self.unique_chunks(texts, metadatas)
+        collection = self.shards[shard_id]._collection
+        # O Chroma limita o tamanho de cada escrita
+        for start in range(0, len(ids), RAGConfig.INDEX_BATCH_SIZE):
+            batch = keep[start:start + RAGConfig.INDEX_BATCH_SIZE]
+            collection.upsert(
+                ids=ids[start:start + RAGConfig.INDEX_BATCH_SIZE],
+                embeddings=[embeddings[i] for i in batch],
+                documents=[texts[i] for i in batch],
+                metadatas=[metadatas[i] for i in batch]
+            )
+        self.shard_sizes[shard_id] = collection.count()
+
+    def add_texts(self, texts: List[str], metadatas: List[Dict],
+                  embeddings: Optional[List[List[float]]] = None) -> None:
+        """
+        Distribui chunks entre os shards e indexa os shards em paralelo
+
+        Os embeddings são calculados uma vez, nesta thread: o modelo não é
+        seguro para uso concorrente e já paraleliza internamente. As coleções
+        também são abertas aqui (criar clientes Chroma em paralelo falha); só
+        a escrita nas coleções roda em paralelo.
+        """
+        if embeddings is None:
+            embeddings = self.embeddings.embed_documents(texts)
+
+        parts = self.partition(texts, metadatas)
+        for shard_id, indices in enumerate(parts):
+            if indices and self.shards[shard_id] is None:
+                self.shards[shard_id] = self._open_shard(shard_id)
+
+        futures = [
+            self._executor.submit(
+                self.build_shard, shard_id,
+                [texts[i] for i in indices],
+                [metadatas[i] for i in indices],
+                [embeddings[i] for i in indices]
+            )
+            for shard_id, indices in enumerate(parts)
+            if indices
+        ]
+        for future in futures:
+            future.result()
+
+    def delete_sources(self, sources: List[str]) -> None:
+        """
+        Remove de todos os shards os chunks já indexados das fontes dadas
+
+        Chamado antes de reindexar uma fonte, para que chunks antigos que não
+        existem mais (ex: documento encurtado) não fiquem no índice.
+        """
+        if not sources:
+            return
+
+        for shard_id, shard in enumerate(self.shards):
+            if shard is not None:
+                shard._collection.delete(where={'source': {'$in': list(sources)}})
+                self.shard_sizes[shard_id] = shard._collection.count()
+
+    def close(self) -> None:
+        """Encerra o pool de threads; os shards em disco são mantidos"""
+        self._executor.shutdown(wait=True)
+
+    def delete(self) -> None:
+        """Remove as coleções de todos os shards e encerra o pool de threads"""
+        for shard in self.shards:
+            if shard is not None:
+                shard.delete_collection()
+        self.shards = [None] * self.num_shards
+        self.shard_sizes = [0] * self.num_shards
+        self.close()
+
+    @classmethod
+    def load(cls, embedding, **kwargs) -> "ShardedVectorStore":
+        """
+        Reabre os shards já persistidos em disco
+
+        Permite buscar em shards construídos por outros processos de ingestão.
+        Shards sem diretório ficam vazios até receberem chunks.
+        """
+        store = cls(embedding, **kwargs)
+        if store.persist_directory is None:
+            return store
+
+        for shard_id in range(store.num_shards):
+            if os.path.isdir(store._shard_directory(shard_id)):
+                store.shards[shard_id] = store._open_shard(shard_id)
+                store.shard_sizes[shard_id] = store.shards[shard_id]._collection.count()
+
+        return store
+
+    @classmethod
+    def from_texts(cls, texts: List[str], embedding, metadatas: List[Dict],
+                   **kwargs) -> "ShardedVectorStore":
+        """Cria o índice particionado e indexa os chunks"""
+        store = cls(embedding, **kwargs)
+        store.add_texts(texts, metadatas)
+        return store
+
+    def similarity_search_by_vector(self, embedding: List[float],
+                                    k: int = RAGConfig.TOP_K_RESULTS) -> List[Document]:
+        """
+        Busca os k chunks mais próximos em todos os shards
+
+        Cada shard devolve seu próprio top-k em paralelo; os resultados são
+        combinados pela distância.
+        """
+        start = time.perf_counter()
+        shards = [shard for shard in self.shards if shard is not None]
+
+        results = self._executor.map(
+            lambda shard: shard.similarity_search_by_vector_with_relevance_scores(embedding, k=k),
+            shards
+        )
+        # Menor distância = mais relevante
+        merged = heapq.nsmallest(
+            k,
+            (hit for shard_results in results for hit in shard_results),
+            key=lambda hit: hit[1]
+        )
+
+        self.last_search_ms = (time.perf_counter() - start) * 1000
+        return [doc for doc, _ in merged]
+
+    def similarity_search(self, query: str, k: int = RAGConfig.TOP_K_RESULTS) -> List[Document]:
+        """Calcula o embedding da query uma vez e busca em todos os shards"""
+        return self.similarity_search_by_vector(self.embeddings.embed_query(query), k=k)
+
+
+def benchmark_shards(embeddings, texts: List[str], metadatas: List[Dict],
+                     queries: List[str], shard_counts: Tuple[int, ...] = (1, 2, 4, 8),
+                     top_k: int = RAGConfig.TOP_K_RESULTS,
+                     strategy: str = RAGConfig.SHARD_STRATEGY) -> Dict[int, Dict[str, float]]:
+    """
+    Mede a latência de busca para diferentes números de shards
+
+    Os índices são criados apenas em memória. Os embeddings dos chunks e das
+    queries são calculados uma vez, antes das medições: 'build_s' mede só a
+    escrita nos shards e 'mean_ms'/'p95_ms' só a busca e o merge.
+
+    Returns:
+        Dicionário {num_shards: {'build_s', 'mean_ms', 'p95_ms'}}
+    """
+    if not texts:
+        raise ValueError("Nenhum chunk fornecido para o benchmark")
+    if not queries:
+        raise ValueError("Nenhuma pergunta fornecida para o benchmark")
+    if not shard_counts:
+        raise ValueError("Nenhum número de shards fornecido para o benchmark")
+
+    text_vectors = embeddings.embed_documents(texts)
+    query_vectors = embeddings.embed_documents(queries)
+    report = {}
+
+    for num_shards in shard_counts:
+        store = ShardedVectorStore(
+            embeddings, num_shards=num_shards, strategy=strategy, persist_directory=None,
+            max_workers=num_shards, collection_name=f"benchmark_{num_shards}"
+        )
+        start = time.perf_counter()
+        store.add_texts(texts, metadatas, embeddings=text_vectors)
+        build_s = time.perf_counter() - start
+
+        latencies = []
+        for vector in query_vectors:
+            store.similarity_search_by_vector(vector, k=top_k)
+            latencies.append(store.last_search_ms)
+        latencies.sort()
+        store.delete()
+
+        report[num_shards] = {
+            'build_s': build_s,
+            'mean_ms': sum(latencies) / len(latencies),
+            'p95_ms': latencies[min(len(latencies) - 1, int(len(latencies) * 0.95))],
+        }
+        print(f"⏱️  {num_shards} shard(s): indexação {build_s:.2f}s | "
+              f"busca média {report[num_shards]['mean_ms']:.1f} ms | "
+              f"p95 {report[num_shards]['p95_ms']:.1f} ms")
+
+    return report